@@ -9,7 +9,16 @@ import asyncio
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload, MediaFileUpload
 from google.oauth2 import service_account
+from googleapiclient.errors import HttpError
+from google.auth.exceptions import TransportError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import tempfile
+import time
+import random
+import socket
+import sqlite3
+import threading
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,18 +33,42 @@ GOOGLE_CLIENT_EMAIL = os.environ.get('GOOGLE_CLIENT_EMAIL')
 GOOGLE_PRIVATE_KEY = os.environ.get('GOOGLE_PRIVATE_KEY', '').replace('\\n', '\n')
 GOOGLE_FOLDER_ID = os.environ.get('GOOGLE_FOLDER_ID')
 
-user_sessions = {}
 USER_DB_FILE = 'users.json'
 AUTH_KEYS_FILE = 'auth_keys.json'
 SUBSCRIPTIONS_FILE = 'subscriptions.json'
+UPLOADS_FILE = 'uploads.json'
+STAGING_DIR = os.environ.get('STAGING_DIR', 'staging')
+
+# Set STATE_DB to a SQLite file to run several replicas on shared state
+STATE_DB = os.environ.get('STATE_DB')
+REPLICA_ID = os.environ.get('REPLICA_ID') or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', '60'))
+PROCESS_JOBS = os.environ.get('PROCESS_JOBS', '1') == '1'
+JOB_MAX_ATTEMPTS = 3
+LOOP_DB_TIMEOUT = 2
+is_coordinator = False
+active_jobs = {}  # job_id -> asyncio task running it
 drive_service = None
+drive_credentials = None
+drive_local = threading.local()
 keep_alive_counter = 0
 
 MAX_FILE_SIZE = 2000 * 1024 * 1024  # 2GB for Drive
 TELEGRAM_LIMIT = 50 * 1024 * 1024   # 50MB for Telegram
 
+CHUNK_UNIT = 256 * 1024             # Drive wants chunks in 256KB multiples
+MIN_CHUNK_SIZE = 1024 * 1024        # 1MB
+MAX_CHUNK_SIZE = 64 * 1024 * 1024   # 64MB
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+TARGET_CHUNK_SECONDS = 10           # aim for one chunk every ~10s
+UPLOAD_MAX_RETRIES = 8
+UPLOAD_MAX_BACKOFF = 60
+UPLOAD_EXPIRY_DAYS = int(os.environ.get('UPLOAD_EXPIRY_DAYS', '3'))
+UPLOAD_SWEEP_SECONDS = 3600
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+
 def init_google_drive():
-    global drive_service
+    global drive_service, drive_credentials
     try:
         if GOOGLE_CREDENTIALS_JSON:
             logger.info("📄 Using JSON credentials")
@@ -56,63 +89,281 @@ def init_google_drive():
             credentials_dict, scopes=['https://www.googleapis.com/auth/drive']
         )
         drive_service = build('drive', 'v3', credentials=credentials)
+        drive_credentials = credentials
+        drive_local.service = drive_service
         logger.info("✅ Drive connected!")
         return drive_service
     except Exception as e:
         logger.error(f"❌ Drive error: {e}")
         return None
 
-def upload_to_drive_chunked(file_data, filename, status_callback=None):
-    """Upload large files with progress"""
+def get_drive():
+    """httplib2 isn't thread-safe, so each thread gets its own Drive client"""
+    service = getattr(drive_local, 'service', None)
+    if service is None:
+        service = build('drive', 'v3', credentials=drive_credentials)
+        drive_local.service = service
+    return service
+
+# Uploads run in threads, keep them from writing uploads.json over each other
+uploads_lock = threading.RLock()
+
+active_uploads = set()
+# Outlives a full backoff sleep, renewed after every chunk
+UPLOAD_LEASE_SECONDS = LEASE_SECONDS + UPLOAD_MAX_BACKOFF
+
+def claim_upload(upload_key):
+    """Only one upload per staged video at a time, False if it's busy.
+
+    The set guards this process, the lease guards other replicas.
+    """
+    with uploads_lock:
+        if upload_key in active_uploads:
+            return False
+        active_uploads.add(upload_key)
     try:
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-        temp_file.write(file_data)
-        temp_file.close()
-        
-        file_metadata = {
-            'name': filename,
-            'parents': [GOOGLE_FOLDER_ID] if GOOGLE_FOLDER_ID else []
-        }
-        
-        media = MediaFileUpload(
-            temp_file.name,
-            mimetype='video/mp4',
-            resumable=True,
-            chunksize=5*1024*1024  # 5MB chunks
-        )
-        
-        request = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id'
-        )
-        
-        response = None
-        while response is None:
+        if acquire_lease(f'upload:{upload_key}', UPLOAD_LEASE_SECONDS):
+            return True
+    except Exception as e:
+        logger.error(f"Upload lease error: {e}")
+    with uploads_lock:
+        active_uploads.discard(upload_key)
+    return False
+
+def renew_upload(upload_key):
+    try:
+        return acquire_lease(f'upload:{upload_key}', UPLOAD_LEASE_SECONDS)
+    except Exception as e:
+        logger.error(f"Upload lease error: {e}")
+        return True  # can't tell, keep going until the lease is clearly gone
+
+def release_upload(upload_key):
+    with uploads_lock:
+        active_uploads.discard(upload_key)
+    try:
+        release_lease(f'upload:{upload_key}')
+    except Exception as e:
+        logger.error(f"Upload lease error: {e}")
+
+def save_upload(upload_key, entry):
+    with uploads_lock:
+        pending_uploads[upload_key] = entry
+        save_state(UPLOADS_FILE, pending_uploads)
+
+def stage_upload(upload_key, file_data, filename, meta=None):
+    """Write video to staging dir and record it as a pending upload"""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(STAGING_DIR, filename))
+    with open(path, 'wb') as f:
+        f.write(file_data)
+    entry = {
+        'path': path,
+        'filename': filename,
+        'size': len(file_data),
+        'session_uri': None,
+        'offset': 0,
+        'chunksize': DEFAULT_CHUNK_SIZE,
+        'created': datetime.now().isoformat(),
+        'meta': meta or {}
+    }
+    save_upload(upload_key, entry)
+    return entry
+
+def discard_upload(upload_key):
+    with uploads_lock:
+        entry = pending_uploads.get(upload_key)
+        if entry is None:
+            return
+        try:
+            del pending_uploads[upload_key]
+        except KeyError:
+            pass  # another replica got there first
+        save_state(UPLOADS_FILE, pending_uploads)
+    try:
+        os.unlink(entry['path'])
+    except:
+        pass
+    try:
+        release_lease(f'upload:{upload_key}')
+    except Exception as e:
+        logger.error(f"Upload lease error: {e}")
+
+def adapt_chunk_size(chunksize, sent, elapsed):
+    """Scale chunk size so one chunk takes about TARGET_CHUNK_SECONDS"""
+    if sent <= 0 or elapsed <= 0:
+        return chunksize
+    target = int(sent / elapsed * TARGET_CHUNK_SECONDS)
+    # Don't grow more than 2x per chunk, one fast chunk can be a fluke
+    target = min(target, chunksize * 2)
+    target = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, target))
+    return target - target % CHUNK_UNIT
+
+def is_rate_limited(e):
+    """Drive signals rate limits as 403 with a rate-limit reason"""
+    if e.resp.status != 403:
+        return False
+    details = e.error_details if isinstance(e.error_details, list) else []
+    if any(isinstance(d, dict) and d.get('reason') in RATE_LIMIT_REASONS for d in details):
+        return True
+    content = e.content.decode('utf-8', 'replace') if isinstance(e.content, bytes) else str(e.content)
+    return any(reason in content for reason in RATE_LIMIT_REASONS)
+
+def is_retryable(e):
+    """Network trouble and Drive's transient statuses are worth another try"""
+    if isinstance(e, HttpError):
+        return e.resp.status >= 500 or e.resp.status in (408, 429) or is_rate_limited(e)
+    if isinstance(e, FileNotFoundError):
+        return False
+    return isinstance(e, (OSError, httplib2.HttpLib2Error, TransportError))
+
+def query_upload_offset(entry):
+    """Ask Drive how much of a resumable session it has.
+
+    Returns (offset, None), or (None, response) if the upload already
+    completed. Raises HttpError for anything else, e.g. 404 once the
+    session has expired.
+    """
+    http = AuthorizedHttp(drive_credentials, http=httplib2.Http())
+    headers = {'Content-Range': f"bytes */{os.path.getsize(entry['path'])}", 'Content-Length': '0'}
+    resp, content = http.request(entry['session_uri'], 'PUT', headers=headers)
+    if resp.status in (200, 201):
+        return None, json.loads(content)
+    if resp.status == 308:
+        # No Range header means Drive has nothing yet
+        if 'range' not in resp:
+            return 0, None
+        return int(resp['range'].split('-')[1]) + 1, None
+    raise HttpError(resp, content, uri=entry['session_uri'])
+
+def new_upload_request(entry):
+    """Build a Drive create request for a staged upload, reusing its session"""
+    file_metadata = {
+        'name': entry['filename'],
+        'parents': [GOOGLE_FOLDER_ID] if GOOGLE_FOLDER_ID else []
+    }
+    media = MediaFileUpload(
+        entry['path'],
+        mimetype='video/mp4',
+        resumable=True,
+        chunksize=entry.get('chunksize', DEFAULT_CHUNK_SIZE)
+    )
+    request = get_drive().files().create(
+        body=file_metadata,
+        media_body=media,
+        fields='id'
+    )
+    if entry.get('session_uri'):
+        request.resumable_uri = entry['session_uri']
+        request.resumable_progress = entry['offset']
+    return request
+
+def upload_to_drive_chunked(file_data, filename, status_callback=None, upload_key=None, meta=None, loop=None):
+    """Resumable upload with retries, survives restarts via the uploads state.
+
+    Blocking, run it with asyncio.to_thread. status_callback is a coroutine
+    function, scheduled on ``loop`` with the progress percentage.
+    """
+    upload_key = upload_key or filename
+    entry = pending_uploads.get(upload_key)
+    if entry is None or not os.path.exists(entry['path']):
+        if file_data is None:
+            logger.error(f"❌ Nothing staged for {upload_key}")
+            discard_upload(upload_key)
+            return None
+        try:
+            entry = stage_upload(upload_key, file_data, filename, meta)
+        except Exception as e:
+            logger.error(f"❌ Staging error: {e}")
+            return None
+    
+    request = new_upload_request(entry)
+    # Ask Drive how much it already has instead of trusting our offset
+    need_sync = bool(entry.get('session_uri'))
+    
+    response = None
+    retries = 0
+    while response is None:
+        try:
+            if need_sync:
+                offset, response = query_upload_offset(entry)
+                need_sync = False
+                if response is not None:
+                    break
+                logger.info(f"🔁 Resuming {entry['filename']} from {offset // (1024*1024)}MB")
+                entry['offset'] = offset
+                save_upload(upload_key, entry)
+                request = new_upload_request(entry)
+            
+            sent_before = request.resumable_progress
+            started = time.monotonic()
             status, response = request.next_chunk()
+            retries = 0
+            
+            sent = request.resumable_progress - sent_before
+            chunksize = adapt_chunk_size(entry['chunksize'], sent, time.monotonic() - started)
+            entry['session_uri'] = request.resumable_uri
+            entry['offset'] = request.resumable_progress
+            if response is None and chunksize != entry['chunksize']:
+                # Chunk size is fixed per MediaFileUpload, so carry on the same session with a new one
+                entry['chunksize'] = chunksize
+                request = new_upload_request(entry)
+            save_upload(upload_key, entry)
+            if response is None and not renew_upload(upload_key):
+                logger.warning(f"⚠️ Upload {entry['filename']} taken over elsewhere, stopping")
+                return None
+            
             if status:
                 progress = int(status.progress() * 100)
-                logger.info(f"Upload progress: {progress}%")
-                if status_callback:
-                    asyncio.create_task(status_callback(progress))
-        
-        os.unlink(temp_file.name)
-        logger.info(f"✅ Uploaded: {response.get('id')}")
-        return response.get('id')
-        
-    except Exception as e:
-        logger.error(f"❌ Upload error: {e}")
-        if 'temp_file' in locals():
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
-        return None
+                logger.info(f"Upload progress: {progress}% (chunk {entry['chunksize'] // (1024*1024)}MB)")
+                if status_callback and loop:
+                    asyncio.run_coroutine_threadsafe(status_callback(progress), loop)
+        except Exception as e:
+            if isinstance(e, HttpError) and e.resp.status in (404, 410) and entry.get('session_uri'):
+                # Session expired on Drive's side, start a fresh one right away
+                logger.warning(f"⚠️ Upload session expired: {entry['filename']}")
+                entry['session_uri'] = None
+                entry['offset'] = 0
+                save_upload(upload_key, entry)
+                request = new_upload_request(entry)
+                need_sync = False
+                continue
+            if isinstance(e, FileNotFoundError):
+                logger.error(f"❌ Staged file gone: {entry['path']}")
+                discard_upload(upload_key)
+                return None
+            if isinstance(e, HttpError) and not is_retryable(e):
+                logger.error(f"❌ Upload error: {e}")
+                discard_upload(upload_key)
+                return None
+            if not is_retryable(e):
+                logger.error(f"❌ Upload error, kept for resume: {e}")
+                return None
+            
+            retries += 1
+            if retries > UPLOAD_MAX_RETRIES:
+                logger.error(f"❌ Upload error, giving up at {entry['offset'] // (1024*1024)}MB: {e}")
+                return None
+            
+            half = entry['chunksize'] // 2
+            entry['chunksize'] = max(MIN_CHUNK_SIZE, half - half % CHUNK_UNIT)
+            save_upload(upload_key, entry)
+            request = new_upload_request(entry)
+            need_sync = bool(entry.get('session_uri'))
+            if not renew_upload(upload_key):
+                logger.warning(f"⚠️ Upload {entry['filename']} taken over elsewhere, stopping")
+                return None
+            delay = min(UPLOAD_MAX_BACKOFF, 2 ** retries) + random.random()
+            logger.warning(f"⚠️ Upload retry {retries}/{UPLOAD_MAX_RETRIES} in {delay:.1f}s: {e}")
+            time.sleep(delay)
+    
+    discard_upload(upload_key)
+    logger.info(f"✅ Uploaded: {response.get('id')}")
+    return response.get('id')
 
 def download_from_drive_chunked(file_id):
     """Download with better error handling"""
     try:
-        request = drive_service.files().get_media(fileId=file_id)
+        request = get_drive().files().get_media(fileId=file_id)
         
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
         downloader = MediaIoBaseDownload(temp_file, request, chunksize=5*1024*1024)
@@ -144,7 +395,7 @@ def download_from_drive_chunked(file_id):
 
 def delete_from_drive(file_id):
     try:
-        drive_service.files().delete(fileId=file_id).execute()
+        get_drive().files().delete(fileId=file_id).execute()
         return True
     except Exception as e:
         logger.error(f"Delete error: {e}")
@@ -166,9 +417,186 @@ def save_json(filename, data):
     except Exception as e:
         logger.error(f"Save error: {e}")
 
-users_db = load_json(USER_DB_FILE, {})
-auth_keys = load_json(AUTH_KEYS_FILE, {})
-subscriptions = load_json(SUBSCRIPTIONS_FILE, {})
+# Without STATE_DB jobs and leases live in a private throwaway database.
+# Not shared-cache :memory:, its table locks fail at once instead of waiting.
+STATE_DB_PATH = STATE_DB or os.path.join(tempfile.mkdtemp(prefix='botstate-'), 'state.db')
+db_local = threading.local()
+
+def get_db():
+    """One SQLite connection per thread, all pointing at the same state.
+
+    The event loop (main thread) renews the coordinator and job leases, so
+    its connection gives up on a locked database after LOOP_DB_TIMEOUT
+    instead of stalling every handler and letting leases lapse. Worker
+    threads can afford to wait.
+    """
+    conn = getattr(db_local, 'conn', None)
+    if conn is None:
+        on_loop = threading.current_thread() is threading.main_thread()
+        timeout = LOOP_DB_TIMEOUT if on_loop else 30
+        conn = sqlite3.connect(STATE_DB_PATH, timeout=timeout, isolation_level=None)
+        conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
+        db_local.conn = conn
+    return conn
+
+def init_state_db():
+    conn = get_db()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS kv (ns TEXT, key TEXT, value TEXT, PRIMARY KEY (ns, key))')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, '
+        'status TEXT, owner TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, created TEXT)'
+    )
+    conn.execute('CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)')
+
+class SharedDict:
+    """Dict stored in the kv table, values are JSON.
+
+    Values come back as copies, so write the whole value back after
+    changing it: ``s = d[k]; s['x'] = 1; d[k] = s``.
+    """
+    def __init__(self, ns):
+        self.ns = ns
+    
+    def __getitem__(self, key):
+        row = get_db().execute('SELECT value FROM kv WHERE ns=? AND key=?', (self.ns, str(key))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+    
+    def __setitem__(self, key, value):
+        get_db().execute(
+            'INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)', (self.ns, str(key), json.dumps(value))
+        )
+    
+    def __delitem__(self, key):
+        if get_db().execute('DELETE FROM kv WHERE ns=? AND key=?', (self.ns, str(key))).rowcount == 0:
+            raise KeyError(key)
+    
+    def __contains__(self, key):
+        return get_db().execute('SELECT 1 FROM kv WHERE ns=? AND key=?', (self.ns, str(key))).fetchone() is not None
+    
+    def __len__(self):
+        return get_db().execute('SELECT COUNT(*) FROM kv WHERE ns=?', (self.ns,)).fetchone()[0]
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def keys(self):
+        return [r[0] for r in get_db().execute('SELECT key FROM kv WHERE ns=?', (self.ns,))]
+    
+    def items(self):
+        return [(r[0], json.loads(r[1])) for r in get_db().execute('SELECT key, value FROM kv WHERE ns=?', (self.ns,))]
+    
+    def values(self):
+        return [v for _, v in self.items()]
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+def load_state(ns, filename):
+    """Shared table when STATE_DB is set, imported once from the old JSON file"""
+    if not STATE_DB:
+        return load_json(filename, {})
+    shared = SharedDict(ns)
+    if len(shared) == 0:
+        for key, value in load_json(filename, {}).items():
+            shared[key] = value
+    return shared
+
+def save_state(filename, data):
+    if isinstance(data, SharedDict):
+        return  # already written through
+    save_json(filename, data)
+
+init_state_db()
+users_db = load_state('users', USER_DB_FILE)
+auth_keys = load_state('auth_keys', AUTH_KEYS_FILE)
+subscriptions = load_state('subscriptions', SUBSCRIPTIONS_FILE)
+user_sessions = SharedDict('sessions') if STATE_DB else {}
+pending_uploads = load_state('uploads', UPLOADS_FILE)
+
+def acquire_lease(name, seconds=None):
+    """Take or renew a named lease, True if this replica holds it"""
+    conn = get_db()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT owner, expires FROM leases WHERE name=?', (name,)).fetchone()
+        if row is None or row[0] == REPLICA_ID or row[1] < now:
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)',
+                (name, REPLICA_ID, now + (seconds or LEASE_SECONDS))
+            )
+            conn.execute('COMMIT')
+            return True
+        conn.execute('COMMIT')
+        return False
+    except:
+        conn.execute('ROLLBACK')
+        raise
+
+def release_lease(name):
+    get_db().execute('DELETE FROM leases WHERE name=? AND owner=?', (name, REPLICA_ID))
+
+def enqueue_job(kind, payload):
+    cur = get_db().execute(
+        'INSERT INTO jobs (kind, payload, status, created) VALUES (?, ?, ?, ?)',
+        (kind, json.dumps(payload), 'queued', datetime.now().isoformat())
+    )
+    logger.info(f"📥 Job {cur.lastrowid} queued: {kind}")
+    return cur.lastrowid
+
+def claim_job():
+    """Lease the oldest queued job, or one whose owner's lease ran out.
+
+    Returns (job_id, kind, payload, attempt). An attempt past
+    JOB_MAX_ATTEMPTS means the job should be cleaned up, not run.
+    """
+    conn = get_db()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(
+            "SELECT id, kind, payload, attempts FROM jobs WHERE status='queued' "
+            "OR (status='running' AND lease_until < ?) ORDER BY id LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        job_id, kind, payload, attempts = row
+        conn.execute(
+            "UPDATE jobs SET status='running', owner=?, lease_until=?, attempts=attempts+1 WHERE id=?",
+            (REPLICA_ID, now + LEASE_SECONDS, job_id)
+        )
+        conn.execute('COMMIT')
+        return job_id, kind, json.loads(payload), attempts + 1
+    except:
+        conn.execute('ROLLBACK')
+        raise
+
+def renew_job(job_id):
+    """Extend our lease on a job, False if another replica took it over"""
+    cur = get_db().execute(
+        "UPDATE jobs SET lease_until=? WHERE id=? AND owner=? AND status='running'",
+        (time.time() + LEASE_SECONDS, job_id, REPLICA_ID)
+    )
+    return cur.rowcount == 1
+
+def update_job(job_id, payload):
+    """Checkpoint job progress so a takeover continues where we stopped"""
+    cur = get_db().execute(
+        "UPDATE jobs SET payload=?, lease_until=? WHERE id=? AND owner=? AND status='running'",
+        (json.dumps(payload), time.time() + LEASE_SECONDS, job_id, REPLICA_ID)
+    )
+    return cur.rowcount == 1
+
+def finish_job(job_id, status='done'):
+    get_db().execute('UPDATE jobs SET status=?, owner=NULL WHERE id=? AND owner=?', (status, job_id, REPLICA_ID))
 
 def generate_auth_key():
     return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(12))
@@ -219,7 +647,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'id': user_id, 'name': user.full_name, 'username': user.username,
             'status': 'active', 'joined': datetime.now().isoformat()
         }
-        save_json(USER_DB_FILE, users_db)
+        save_state(USER_DB_FILE, users_db)
     
     is_sub, status = check_subscription(user_id)
     
@@ -335,15 +763,27 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     status = await update.message.reply_text("⏳ Starting upload to Drive...")
     
+    upload_key = f"{user_id}_{video.file_unique_id}"
+    if not claim_upload(upload_key):
+        await status.edit_text("⏳ This video is already uploading, hang on!")
+        return
+    
     try:
-        video_file = await context.bot.get_file(video.file_id)
+        video_bytes = None
         
-        await status.edit_text(f"📥 Downloading... ({file_size // (1024*1024)}MB)")
-        video_bytes = await video_file.download_as_bytearray()
-        
-        filename = f"v_{user_id}_{len(session['videos'])}_{int(datetime.now().timestamp())}.mp4"
-        
-        await status.edit_text("☁️ Uploading to Drive...")
+        if upload_key in pending_uploads and os.path.exists(pending_uploads[upload_key]['path']):
+            # Same video failed before, continue from what Drive already has
+            filename = pending_uploads[upload_key]['filename']
+            await status.edit_text("🔁 Resuming previous upload...")
+        else:
+            video_file = await context.bot.get_file(video.file_id)
+            
+            await status.edit_text(f"📥 Downloading... ({file_size // (1024*1024)}MB)")
+            video_bytes = await video_file.download_as_bytearray()
+            
+            filename = f"v_{user_id}_{video.file_unique_id}_{int(datetime.now().timestamp())}.mp4"
+            
+            await status.edit_text("☁️ Uploading to Drive...")
         
         async def update_progress(progress):
             try:
@@ -351,21 +791,33 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except:
                 pass
         
-        drive_id = upload_to_drive_chunked(video_bytes, filename, update_progress)
-        
-        if not drive_id:
-            await status.edit_text("❌ Upload failed! Try smaller video or try again.")
-            return
-        
-        session['videos'].append({
-            'drive_id': drive_id,
+        video_info = {
             'caption': update.message.caption or "",
             'duration': video.duration,
             'width': video.width,
             'height': video.height,
             'filename': filename,
             'size': file_size
-        })
+        }
+        meta = {'user_id': user_id, 'video': video_info}
+        drive_id = await asyncio.to_thread(
+            upload_to_drive_chunked, video_bytes, filename, update_progress, upload_key, meta,
+            asyncio.get_running_loop()
+        )
+        
+        if not drive_id:
+            if upload_key in pending_uploads:
+                await status.edit_text("❌ Upload interrupted! Send the same video again to resume.")
+            else:
+                await status.edit_text("❌ Upload failed! Try smaller video or try again.")
+            return
+        
+        # Other videos may have landed while this one uploaded, re-read before adding
+        session = user_sessions.get(user_id)
+        if not session or 'videos' not in session:
+            session = {'videos': [], 'step': 'collecting'}
+        session['videos'].append({'drive_id': drive_id, **video_info})
+        user_sessions[user_id] = session
         
         count = len(session['videos'])
         size_mb = file_size // (1024*1024)
@@ -379,6 +831,8 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Video error: {e}")
         await status.edit_text(f"❌ Error: {str(e)}\n\nTry again or smaller video.")
+    finally:
+        release_upload(upload_key)
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -395,6 +849,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo = update.message.photo[-1]
     session['thumbnail'] = photo.file_id
     session['step'] = 'got_thumb'
+    user_sessions[user_id] = session
     
     await update.message.reply_text(
         "✅ <b>Thumbnail saved!</b>\n\nReplace caption?\n• <code>yes</code>\n• <code>no</code>",
@@ -418,10 +873,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'expiry': expiry.isoformat(),
                 'duration': key['duration_str']
             }
-            auth_keys[text]['used'] = True
-            auth_keys[text]['used_by'] = user_id
-            save_json(SUBSCRIPTIONS_FILE, subscriptions)
-            save_json(AUTH_KEYS_FILE, auth_keys)
+            key['used'] = True
+            key['used_by'] = user_id
+            auth_keys[text] = key
+            save_state(SUBSCRIPTIONS_FILE, subscriptions)
+            save_state(AUTH_KEYS_FILE, auth_keys)
             await update.message.reply_text(
                 f"🎉 <b>Activated!</b>\n\n✅ Duration: {key['duration_str']}\n\n/start",
                 parse_mode=ParseMode.HTML
@@ -447,7 +903,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'created': datetime.now().isoformat(),
                 'used': False
             }
-            save_json(AUTH_KEYS_FILE, auth_keys)
+            save_state(AUTH_KEYS_FILE, auth_keys)
             await update.message.reply_text(f"🔑 <code>{key}</code>\n\n⏱️ {text}", parse_mode=ParseMode.HTML)
             del user_sessions[user_id]
             return
@@ -467,6 +923,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ No videos!")
             return
         session['step'] = 'wait_thumb'
+        user_sessions[user_id] = session
         await update.message.reply_text(
             f"✅ <b>{len(session['videos'])} ready!</b>\n\n📸 Send thumbnail",
             parse_mode=ParseMode.HTML
@@ -476,54 +933,85 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text_lower in ['yes', 'no'] and step == 'got_thumb':
         if text_lower == 'yes':
             session['step'] = 'wait_find'
+            user_sessions[user_id] = session
             await update.message.reply_text("🔍 <b>Find:</b>", parse_mode=ParseMode.HTML)
         else:
-            await process_videos(update, context, user_id)
+            await queue_videos(context.bot, user_id)
         return
     
     if step == 'wait_find':
         session['find'] = text
         session['step'] = 'wait_replace'
+        user_sessions[user_id] = session
         await update.message.reply_text(f"✅ Find: <code>{text}</code>\n\n📝 Replace:", parse_mode=ParseMode.HTML)
         return
     
     if step == 'wait_replace':
         session['replace'] = text
-        await update.message.reply_text("⏳ Processing...", parse_mode=ParseMode.HTML)
-        await process_videos(update, context, user_id)
+        user_sessions[user_id] = session
+        await queue_videos(context.bot, user_id)
         return
 
-async def process_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+async def queue_videos(bot, user_id: int):
+    """Hand the session over to a worker, any replica may pick it up"""
     session = user_sessions[user_id]
-    videos = session['videos']
-    thumb_id = session.get('thumbnail')
-    find = session.get('find')
-    replace = session.get('replace')
+    del user_sessions[user_id]
+    total = len(session['videos'])
+    status = await bot.send_message(
+        user_id, f"⏳ <b>Queued {total}...</b>", parse_mode=ParseMode.HTML
+    )
+    enqueue_job('process_videos', {
+        'user_id': user_id,
+        'videos': session['videos'],
+        'thumbnail': session.get('thumbnail'),
+        'find': session.get('find'),
+        'replace': session.get('replace'),
+        'status_msg': status.message_id,
+        'done': 0,
+        'success': 0
+    })
+
+async def edit_job_status(bot, job, text):
+    try:
+        await bot.edit_message_text(
+            text, chat_id=job['user_id'], message_id=job['status_msg'], parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        logger.error(f"Status error: {e}")
+
+async def process_videos(bot, job_id, job):
+    user_id = job['user_id']
+    videos = job['videos']
+    thumb_id = job.get('thumbnail')
+    find = job.get('find')
+    replace = job.get('replace')
     
     total = len(videos)
-    status = await context.bot.send_message(
-        user_id, f"⏳ <b>Processing {total}...</b>", parse_mode=ParseMode.HTML
-    )
+    
+    async def edit_status(text):
+        await edit_job_status(bot, job, text)
+    
+    await edit_status(f"⏳ <b>Processing {total}...</b>")
     
     thumb_bytes = None
     if thumb_id:
         try:
-            thumb_file = await context.bot.get_file(thumb_id)
+            thumb_file = await bot.get_file(thumb_id)
             thumb_bytes = await thumb_file.download_as_bytearray()
         except Exception as e:
             logger.error(f"Thumb error: {e}")
     
-    success = 0
-    for idx, video in enumerate(videos, 1):
+    # Skip videos a previous lease holder already finished
+    lease_ok = True
+    for idx, video in enumerate(videos[job['done']:], job['done'] + 1):
+        if not lease_ok:
+            break
         try:
-            await status.edit_text(
-                f"⏳ <b>{idx}/{total}</b>\n\n📥 Downloading from Drive...",
-                parse_mode=ParseMode.HTML
-            )
+            await edit_status(f"⏳ <b>{idx}/{total}</b>\n\n📥 Downloading from Drive...")
             
-            video_data = download_from_drive_chunked(video['drive_id'])
+            video_data = await asyncio.to_thread(download_from_drive_chunked, video['drive_id'])
             if not video_data:
-                await context.bot.send_message(user_id, f"❌ Video {idx} download failed")
+                await bot.send_message(user_id, f"❌ Video {idx} download failed")
                 continue
             
             caption = video['caption']
@@ -533,7 +1021,7 @@ async def process_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, use
             video_size = len(video_data)
             
             if video_size > TELEGRAM_LIMIT:
-                await context.bot.send_message(
+                await bot.send_message(
                     user_id,
                     f"⚠️ Video {idx} ({video_size//(1024*1024)}MB) too large for Telegram (max 50MB).\n"
                     f"Saved in Drive. Download manually if needed.",
@@ -541,12 +1029,9 @@ async def process_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, use
                 )
                 continue
             
-            await status.edit_text(
-                f"⏳ <b>{idx}/{total}</b>\n\n📤 Uploading with new thumbnail...",
-                parse_mode=ParseMode.HTML
-            )
+            await edit_status(f"⏳ <b>{idx}/{total}</b>\n\n📤 Uploading with new thumbnail...")
             
-            await context.bot.send_video(
+            await bot.send_video(
                 chat_id=user_id,
                 video=io.BytesIO(video_data),
                 caption=caption if caption else None,
@@ -558,27 +1043,51 @@ async def process_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, use
                 filename=video['filename']
             )
             
-            delete_from_drive(video['drive_id'])
-            success += 1
+            await asyncio.to_thread(delete_from_drive, video['drive_id'])
+            job['success'] += 1
             
-            await status.edit_text(
-                f"⏳ <b>{idx}/{total}</b>\n✅ Done: {success}",
-                parse_mode=ParseMode.HTML
-            )
+            await edit_status(f"⏳ <b>{idx}/{total}</b>\n✅ Done: {job['success']}")
         except Exception as e:
             logger.error(f"Process error {idx}: {e}")
-            await context.bot.send_message(user_id, f"❌ Video {idx}: {str(e)}")
+            await bot.send_message(user_id, f"❌ Video {idx}: {str(e)}")
+        finally:
+            job['done'] = idx
+            lease_ok = update_job(job_id, job)
+    
+    if not lease_ok:
+        logger.warning(f"⚠️ Lost lease on job {job_id}, stopping")
+        return
     
     summary = (
         f"✅ <b>Complete!</b>\n\n"
-        f"📹 Done: {success}/{total}\n"
+        f"📹 Done: {job['success']}/{total}\n"
         f"🖼️ Thumbnail: {'✅' if thumb_id else '❌'}\n"
         f"✏️ Caption: {'✅' if find else '❌'}\n\n"
         f"/start"
     )
-    await status.edit_text(summary, parse_mode=ParseMode.HTML)
-    if user_id in user_sessions:
-        del user_sessions[user_id]
+    await edit_status(summary)
+    finish_job(job_id)
+
+async def fail_videos(bot, job_id, job):
+    """Out of attempts: tell the user and clear what's left in Drive"""
+    for video in job['videos'][job['done']:]:
+        await asyncio.to_thread(delete_from_drive, video['drive_id'])
+    await edit_job_status(
+        bot, job,
+        f"❌ <b>Processing failed!</b>\n\n"
+        f"📹 Done: {job['success']}/{len(job['videos'])}\n\n"
+        f"Send the rest again. /start"
+    )
+    finish_job(job_id, 'failed')
+
+JOB_HANDLERS = {
+    'process_videos': process_videos,
+}
+
+# Run instead of the handler once a job has used up JOB_MAX_ATTEMPTS
+JOB_FAILURE_HANDLERS = {
+    'process_videos': fail_videos,
+}
 
 async def do_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, message):
     success = fail = 0
@@ -595,7 +1104,7 @@ async def do_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, messa
             success += 1
         except:
             fail += 1
-    save_json(USER_DB_FILE, users_db)
+    save_state(USER_DB_FILE, users_db)
     await status.edit_text(f"✅ Sent: {success}\n✗ Failed: {fail}", parse_mode=ParseMode.HTML)
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -604,10 +1113,165 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         session = user_sessions[user_id]
         if 'videos' in session:
             for video in session['videos']:
-                delete_from_drive(video.get('drive_id'))
+                await asyncio.to_thread(delete_from_drive, video.get('drive_id'))
         del user_sessions[user_id]
+    for key in [k for k, v in pending_uploads.items() if v.get('meta', {}).get('user_id') == user_id]:
+        discard_upload(key)
     await update.message.reply_text("❌ Cancelled! /start")
 
+async def expire_pending_uploads(bot):
+    """Drop staged uploads nobody finished within UPLOAD_EXPIRY_DAYS"""
+    for upload_key in list(pending_uploads):
+        entry = pending_uploads.get(upload_key)
+        if not entry:
+            continue
+        if datetime.now() - datetime.fromisoformat(entry['created']) <= timedelta(days=UPLOAD_EXPIRY_DAYS):
+            continue
+        if not claim_upload(upload_key):
+            continue  # someone is still working on it
+        try:
+            logger.info(f"🗑️ Expired upload: {entry['filename']}")
+            discard_upload(upload_key)
+        finally:
+            release_upload(upload_key)
+        
+        user_id = entry.get('meta', {}).get('user_id')
+        if user_id:
+            try:
+                await bot.send_message(
+                    user_id,
+                    f"⌛ Unfinished upload <code>{entry['filename']}</code> expired after "
+                    f"{UPLOAD_EXPIRY_DAYS}d and was removed. Send the video again.",
+                    parse_mode=ParseMode.HTML
+                )
+            except Exception as e:
+                logger.error(f"Expiry notify error: {e}")
+
+async def upload_sweep_task(bot):
+    """Expire stale uploads regularly, not just when a coordinator starts"""
+    while True:
+        await asyncio.sleep(UPLOAD_SWEEP_SECONDS)
+        if not is_coordinator:
+            continue
+        try:
+            await expire_pending_uploads(bot)
+        except Exception as e:
+            logger.error(f"Upload sweep error: {e}")
+
+async def resume_pending_uploads(bot):
+    """Finish uploads interrupted by a restart and hand them back to users"""
+    await expire_pending_uploads(bot)
+    for upload_key in list(pending_uploads):
+        entry = pending_uploads.get(upload_key)
+        if not entry or not claim_upload(upload_key):
+            continue
+        meta = entry.get('meta', {})
+        user_id = meta.get('user_id')
+        
+        logger.info(f"🔁 Pending upload: {entry['filename']}")
+        try:
+            drive_id = await asyncio.to_thread(upload_to_drive_chunked, None, entry['filename'], upload_key=upload_key)
+        finally:
+            release_upload(upload_key)
+        if not drive_id or not user_id:
+            continue
+        
+        # Add to whatever batch the user has going, never drop a live session
+        session = user_sessions.get(user_id) or {'step': 'collecting'}
+        session.setdefault('videos', [])
+        session['videos'].append({'drive_id': drive_id, **meta.get('video', {})})
+        user_sessions[user_id] = session
+        try:
+            await bot.send_message(
+                user_id,
+                f"✅ <b>Video {len(session['videos'])} upload resumed & finished!</b>\n\n"
+                f"Added to your current batch.",
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e:
+            logger.error(f"Resume notify error: {e}")
+
+async def job_worker(bot):
+    """Claim leased jobs from the shared queue and run them"""
+    while True:
+        try:
+            claimed = claim_job()
+            if not claimed:
+                await asyncio.sleep(2)
+                continue
+            
+            job_id, kind, payload, attempt = claimed
+            if attempt > JOB_MAX_ATTEMPTS:
+                logger.error(f"❌ Job {job_id} failed after {JOB_MAX_ATTEMPTS} attempts")
+                run = JOB_FAILURE_HANDLERS[kind]
+            else:
+                logger.info(f"⚙️ Job {job_id} ({kind}) attempt {attempt} on {REPLICA_ID}")
+                run = JOB_HANDLERS[kind]
+            
+            task = asyncio.create_task(run(bot, job_id, payload))
+            active_jobs[job_id] = task
+            await asyncio.wait([task])
+            active_jobs.pop(job_id, None)
+            
+            if task.cancelled():
+                logger.warning(f"⚠️ Lost lease on job {job_id}, abandoned")
+            elif task.exception():
+                logger.error(f"Job {job_id} error: {task.exception()}")
+                try:
+                    finish_job(job_id, 'queued')  # let any replica retry it
+                except Exception as e:
+                    logger.error(f"Requeue error {job_id}: {e}")
+        except Exception as e:
+            logger.error(f"Worker error: {e}")
+            await asyncio.sleep(2)
+
+async def job_lease_task():
+    """Renew job leases from the loop, so a hung replica lets its jobs go"""
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        for job_id, task in list(active_jobs.items()):
+            try:
+                if not renew_job(job_id):
+                    logger.warning(f"⚠️ Job {job_id} taken over, stopping it")
+                    task.cancel()
+            except Exception as e:
+                logger.error(f"Lease renew error: {e}")
+
+async def coordinator_task(app):
+    """Only the replica holding the coordinator lease polls Telegram.
+
+    Also renews that lease, so it lapses if this loop stops running.
+    """
+    global is_coordinator
+    renewed_at = 0
+    resume_task = None
+    while True:
+        try:
+            has_lease = acquire_lease('coordinator')
+            if has_lease:
+                renewed_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Coordinator lease error: {e}")
+            # A busy database isn't a lost lease, unless it has had time to expire
+            has_lease = is_coordinator and time.monotonic() - renewed_at < LEASE_SECONDS
+        
+        try:
+            if has_lease and not is_coordinator:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                is_coordinator = True
+                logger.info(f"👑 {REPLICA_ID} is coordinator, polling Telegram")
+                if pending_uploads and (resume_task is None or resume_task.done()):
+                    logger.info(f"🔁 Resuming {len(pending_uploads)} upload(s)")
+                    resume_task = asyncio.create_task(resume_pending_uploads(app.bot))
+            elif not has_lease and is_coordinator:
+                is_coordinator = False
+                logger.warning(f"⚠️ {REPLICA_ID} lost coordinator lease, stopping polling")
+                await app.updater.stop()
+        except Exception as e:
+            logger.error(f"Coordinator error: {e}")
+        
+        await asyncio.sleep(LEASE_SECONDS / 3)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Error: {context.error}")
 
@@ -621,7 +1285,8 @@ async def keep_alive_task():
 
 async def health_check(request):
     return web.Response(
-        text=f"🎬 Bot Running!\n�� {keep_alive_counter}s\n☁️ Drive: {'✅' if drive_service else '❌'}"
+        text=f"🎬 Bot Running!\n�� {keep_alive_counter}s\n☁️ Drive: {'✅' if drive_service else '❌'}\n"
+             f"🧩 {REPLICA_ID}: {'coordinator' if is_coordinator else 'worker'}"
     )
 
 async def start_web_server():
@@ -649,7 +1314,8 @@ async def main():
         logger.error("Set: GOOGLE_CREDENTIALS_JSON and GOOGLE_FOLDER_ID")
         return
     
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Uploads run in threads, so let other users' updates through meanwhile
+    app = Application.builder().token(BOT_TOKEN).concurrent_updates(True).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("cancel", cancel_command))
     app.add_handler(CallbackQueryHandler(button_callback))
@@ -665,16 +1331,27 @@ async def main():
     logger.info(f"👥 Users: {len(users_db)}")
     logger.info(f"☁️ Drive: Connected")
     logger.info(f"📦 Max size: 2GB (Drive), 50MB (Telegram)")
+    logger.info(f"🔁 Pending uploads: {len(pending_uploads)}")
+    logger.info(f"🧩 Replica: {REPLICA_ID} ({'shared: ' + STATE_DB if STATE_DB else 'single'})")
+    logger.info(f"⚙️ Jobs: {'✅' if PROCESS_JOBS else '❌'}")
     logger.info("=" * 60)
     
     await app.initialize()
     await app.start()
-    await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    
+    asyncio.create_task(coordinator_task(app))
+    asyncio.create_task(upload_sweep_task(app.bot))
+    if PROCESS_JOBS:
+        asyncio.create_task(job_worker(app.bot))
+        asyncio.create_task(job_lease_task())
     
     try:
         while True:
             await asyncio.sleep(3600)
     except (KeyboardInterrupt, SystemExit):
+        if is_coordinator:
+            await app.updater.stop()
+            release_lease('coordinator')
         await app.stop()
 
 if __name__ == '__main__':
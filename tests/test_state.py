@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+import bot
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    db = bot.get_db()
+    for table in ('kv', 'jobs', 'leases'):
+        db.execute(f'DELETE FROM {table}')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-a')
+
+
+def expire_lease(name):
+    bot.get_db().execute('UPDATE leases SET expires=? WHERE name=?', (time.time() - 1, name))
+
+
+def expire_job(job_id):
+    bot.get_db().execute('UPDATE jobs SET lease_until=? WHERE id=?', (time.time() - 1, job_id))
+
+
+def test_shared_dict_round_trip():
+    d = bot.SharedDict('test')
+    d[42] = {'videos': [{'drive_id': 'x'}], 'step': 'collecting'}
+    assert 42 in d and '42' in d
+    assert d[42] == {'videos': [{'drive_id': 'x'}], 'step': 'collecting'}
+    assert len(d) == 1
+    assert d.items() == [('42', d[42])]
+    del d[42]
+    assert 42 not in d
+    assert d.get(42) is None
+    with pytest.raises(KeyError):
+        del d[42]
+
+
+def test_shared_dict_returns_copies():
+    d = bot.SharedDict('test')
+    d['s'] = {'videos': []}
+    d['s']['videos'].append(1)
+    assert d['s'] == {'videos': []}
+
+
+def test_lease_is_exclusive_until_it_expires(monkeypatch):
+    assert bot.acquire_lease('coordinator')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-b')
+    assert not bot.acquire_lease('coordinator')
+    expire_lease('coordinator')
+    assert bot.acquire_lease('coordinator')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-a')
+    assert not bot.acquire_lease('coordinator')
+
+
+def test_release_only_drops_own_lease(monkeypatch):
+    bot.acquire_lease('coordinator')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-b')
+    bot.release_lease('coordinator')
+    assert not bot.acquire_lease('coordinator')
+
+
+def test_upload_claim_blocks_other_replicas(monkeypatch):
+    assert bot.claim_upload('u1')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-b')
+    bot.active_uploads.discard('u1')  # as seen from another process
+    assert not bot.claim_upload('u1')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-a')
+    bot.active_uploads.add('u1')
+    bot.release_upload('u1')
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-b')
+    assert bot.claim_upload('u1')
+    bot.release_upload('u1')
+
+
+def test_jobs_are_claimed_in_order_once():
+    first = bot.enqueue_job('process_videos', {'n': 1})
+    bot.enqueue_job('process_videos', {'n': 2})
+    assert bot.claim_job() == (first, 'process_videos', {'n': 1}, 1)
+    _, _, payload, _ = bot.claim_job()
+    assert payload == {'n': 2}
+    assert bot.claim_job() is None
+
+
+def test_expired_job_lease_is_taken_over(monkeypatch):
+    job_id = bot.enqueue_job('process_videos', {'done': 0})
+    bot.claim_job()
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-b')
+    assert bot.claim_job() is None
+    expire_job(job_id)
+    assert bot.claim_job() == (job_id, 'process_videos', {'done': 0}, 2)
+    assert bot.update_job(job_id, {'done': 1})
+    monkeypatch.setattr(bot, 'REPLICA_ID', 'replica-a')
+    # The old owner can no longer renew, checkpoint or finish it
+    assert not bot.renew_job(job_id)
+    assert not bot.update_job(job_id, {'done': 5})
+    bot.finish_job(job_id)
+    status = bot.get_db().execute('SELECT status, payload FROM jobs WHERE id=?', (job_id,)).fetchone()
+    assert status == ('running', '{"done": 1}')
+
+
+def test_finished_job_is_not_claimed_again():
+    job_id = bot.enqueue_job('process_videos', {})
+    bot.claim_job()
+    bot.finish_job(job_id)
+    expire_job(job_id)
+    assert bot.claim_job() is None
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+def test_job_out_of_attempts_goes_to_fail_videos(monkeypatch):
+    runs = []
+    deleted = []
+
+    async def always_fails(bot_, job_id, job):
+        runs.append(job_id)
+        raise RuntimeError('boom')
+
+    monkeypatch.setitem(bot.JOB_HANDLERS, 'process_videos', always_fails)
+    monkeypatch.setattr(bot, 'delete_from_drive', deleted.append)
+    job_id = bot.enqueue_job('process_videos', {
+        'user_id': 1, 'status_msg': 7, 'done': 1, 'success': 1,
+        'videos': [{'drive_id': 'sent'}, {'drive_id': 'left-1'}, {'drive_id': 'left-2'}]
+    })
+    fake = FakeBot()
+
+    async def run():
+        worker = asyncio.create_task(bot.job_worker(fake))
+        for _ in range(100):
+            row = bot.get_db().execute('SELECT status FROM jobs WHERE id=?', (job_id,)).fetchone()
+            if row[0] == 'failed':
+                break
+            await asyncio.sleep(0.05)
+        worker.cancel()
+
+    asyncio.run(run())
+    assert runs == [job_id] * bot.JOB_MAX_ATTEMPTS
+    assert deleted == ['left-1', 'left-2']
+    assert 'Processing failed' in fake.edits[-1]
+    assert bot.get_db().execute('SELECT status FROM jobs WHERE id=?', (job_id,)).fetchone() == ('failed',)
@@ -0,0 +1,106 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import bot
+
+MB = 1024 * 1024
+
+
+def http_error(status, reason=None):
+    content = b'{}'
+    if reason:
+        content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+def test_chunk_size_follows_throughput():
+    # 2MB in 1s with a 10s target -> 20MB, but growth is capped at 2x
+    assert bot.adapt_chunk_size(5 * MB, 2 * MB, 1.0) == 10 * MB
+    # Slow link shrinks the chunk, never below the minimum
+    assert bot.adapt_chunk_size(8 * MB, 1 * MB, 100.0) == bot.MIN_CHUNK_SIZE
+
+
+def test_chunk_size_stays_aligned_and_bounded():
+    size = bot.adapt_chunk_size(48 * MB, 7 * MB + 12345, 1.0)
+    assert size % bot.CHUNK_UNIT == 0
+    assert size <= bot.MAX_CHUNK_SIZE
+    assert bot.adapt_chunk_size(5 * MB, 0, 1.0) == 5 * MB
+
+
+@pytest.mark.parametrize('status', [408, 429, 500, 503])
+def test_transient_statuses_are_retried(status):
+    assert bot.is_retryable(http_error(status))
+
+
+@pytest.mark.parametrize('reason', ['userRateLimitExceeded', 'rateLimitExceeded'])
+def test_rate_limited_403_is_retried(reason):
+    assert bot.is_retryable(http_error(403, reason))
+
+
+def test_permanent_errors_are_not_retried():
+    assert not bot.is_retryable(http_error(403, 'insufficientFilePermissions'))
+    assert not bot.is_retryable(http_error(400))
+    assert not bot.is_retryable(FileNotFoundError('gone'))
+    assert not bot.is_retryable(ValueError('bug'))
+
+
+def test_network_errors_are_retried():
+    assert bot.is_retryable(ConnectionResetError())
+    assert bot.is_retryable(httplib2.ServerNotFoundError())
+
+
+def test_upload_claim_is_exclusive():
+    assert bot.claim_upload('k1')
+    assert not bot.claim_upload('k1')
+    bot.release_upload('k1')
+    assert bot.claim_upload('k1')
+    bot.release_upload('k1')
+
+
+class FakeHttp:
+    def __init__(self, status, headers=None, content=b''):
+        self.response = httplib2.Response({'status': status, **(headers or {})})
+        self.content = content
+        self.sent = None
+
+    def request(self, uri, method, headers=None):
+        self.sent = (uri, method, headers)
+        return self.response, self.content
+
+
+@pytest.fixture
+def staged(tmp_path, monkeypatch):
+    path = tmp_path / 'v.mp4'
+    path.write_bytes(b'x' * 1000)
+    return {'path': str(path), 'session_uri': 'https://upload/session'}
+
+
+def use_http(monkeypatch, fake):
+    monkeypatch.setattr(bot, 'AuthorizedHttp', lambda credentials, http: fake)
+
+
+def test_offset_query_reads_range(staged, monkeypatch):
+    fake = FakeHttp(308, {'range': 'bytes=0-499'})
+    use_http(monkeypatch, fake)
+    assert bot.query_upload_offset(staged) == (500, None)
+    assert fake.sent[1] == 'PUT'
+    assert fake.sent[2]['Content-Range'] == 'bytes */1000'
+
+
+def test_offset_query_without_range_starts_over(staged, monkeypatch):
+    use_http(monkeypatch, FakeHttp(308))
+    assert bot.query_upload_offset(staged) == (0, None)
+
+
+def test_offset_query_finished_upload(staged, monkeypatch):
+    use_http(monkeypatch, FakeHttp(200, content=b'{"id": "abc"}'))
+    assert bot.query_upload_offset(staged) == (None, {'id': 'abc'})
+
+
+def test_offset_query_expired_session(staged, monkeypatch):
+    use_http(monkeypatch, FakeHttp(404))
+    with pytest.raises(HttpError):
+        bot.query_upload_offset(staged)